@@ -1,88 +1,112 @@
 """
-Flask web application for SBT eligibility checking.
+FastAPI web application for SBT eligibility checking.
 """
 
-from flask import Flask, render_template, request, jsonify
-import json
-from sbt_checker import check_sbt_eligibility
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
 
-app = Flask(__name__)
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse
+from fastapi.templating import Jinja2Templates
 
+from sbt_batcher import EligibilityBatcher, evaluate_batch
+from sbt_checker import InvalidPatientData
+from sbt_ingest import check_large_payload, load_form_data
 
-@app.route('/')
-def index():
+# Bodies larger than this (roughly 64 vitals) are parsed and checked in a
+# worker process so that the event loop never handles their vitals; smaller
+# ones are not worth the round trip. Workers come from a forkserver because
+# forking a process that is already serving (event loop, threads) is unsafe.
+# SBT_POOL_WORKERS sizes the pool when several server processes share the
+# machine (see gunicorn.conf.py); a single process gets one worker per core.
+POOL_BODY_THRESHOLD = 4096
+POOL_WORKERS = int(os.environ.get('SBT_POOL_WORKERS') or os.cpu_count())
+_pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context('forkserver'))
+
+# Everything else is coalesced with concurrent requests and checked in batches
+_batcher = EligibilityBatcher()
+
+# Dashboards poll the same patient repeatedly until new vitals arrive. Results
+# are cached per check date and digest of the raw request body, so a repeated
+# payload skips parsing and checking; any change to the vitals, medications or
+# patient details is a different key.
+RESULT_CACHE_SIZE = 4096
+_results: 'OrderedDict[Tuple[date, bytes], Optional[Dict[str, Any]]]' = OrderedDict()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compile (or load from cache) the batch kernel before serving, so the
+    # first batch does not stall the event loop
+    evaluate_batch([])
+    _batcher.start()
+    yield
+    await _batcher.stop()
+    _pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+
+# The form page is static, so it is rendered once and served with an ETag
+_INDEX_HTML = templates.get_template('index.html').render().encode()
+_INDEX_HEADERS = {
+    'Cache-Control': 'public, max-age=3600',
+    'ETag': '"%s"' % hashlib.blake2b(_INDEX_HTML, digest_size=16).hexdigest(),
+}
+
+
+@app.api_route('/', methods=['GET', 'HEAD'])
+async def index(request: Request):
     """Serve the main form page."""
-    return render_template('index.html')
+    # If-None-Match is "*" or a list of ETags, possibly weak (W/"...")
+    etags = [etag.strip().removeprefix('W/') for etag in request.headers.get('if-none-match', '').split(',')]
+    if '*' in etags or _INDEX_HEADERS['ETag'] in etags:
+        return Response(status_code=304, headers=_INDEX_HEADERS)
+    return Response(_INDEX_HTML, media_type='text/html', headers=_INDEX_HEADERS)
 
 
-@app.route('/check', methods=['POST'])
-def check():
+@app.post('/check')
+async def check(request: Request):
     """Process patient data and return SBT eligibility result."""
-    try:
-        # Get JSON data from request
-        form_data = request.get_json()
-        
-        if not form_data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        # Construct patient JSON from form data
-        patient_json = {
-            'CPMRN': form_data.get('CPMRN', ''),
-            'name': form_data.get('name', ''),
-            'lastName': form_data.get('lastName', ''),
-            'hospitalName': form_data.get('hospitalName', ''),
-            'unitName': form_data.get('unitName', ''),
-            'bedNo': form_data.get('bedNo', ''),
-            'orders': {
-                'active': {
-                    'medications': []
-                }
-            },
-            'vitals': []
-        }
-        
-        # Add active medications
-        medications = form_data.get('medications', [])
-        for med_name in medications:
-            if med_name and med_name.strip():
-                patient_json['orders']['active']['medications'].append({
-                    'name': med_name.strip()
-                })
-        
-        # Add latest vital
-        latest_vital = form_data.get('latestVital', {})
-        if latest_vital:
-            vital_entry = {
-                'timestamp': latest_vital.get('timestamp'),
-                'daysFiO2': latest_vital.get('daysFiO2'),
-                'daysVentPEEP': latest_vital.get('daysVentPEEP')
-            }
-            patient_json['vitals'].append(vital_entry)
-        
-        # Add other vitals since 12am
-        vitals = form_data.get('vitals', [])
-        for vital in vitals:
-            vital_entry = {
-                'timestamp': vital.get('timestamp')
-            }
-            if 'daysVentBreathSequence' in vital:
-                vital_entry['daysVentBreathSequence'] = vital.get('daysVentBreathSequence')
-            if 'daysHR' in vital:
-                vital_entry['daysHR'] = vital.get('daysHR')
-            patient_json['vitals'].append(vital_entry)
-        
-        # Check SBT eligibility
-        result = check_sbt_eligibility(patient_json)
-        
+    body = await request.body()
+    cache_key = (date.today(), hashlib.blake2b(body, digest_size=16).digest())
+    if cache_key in _results:
+        _results.move_to_end(cache_key)
+        result = _results[cache_key]
         if result:
-            return jsonify(result), 200
+            return ORJSONResponse({**result, 'createdAt': datetime.now().isoformat()})
+        return ORJSONResponse({'message': 'Patient does not meet SBT eligibility criteria'})
+
+    try:
+        if len(body) > POOL_BODY_THRESHOLD:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(_pool, check_large_payload, body)
+            except InvalidPatientData as e:
+                return ORJSONResponse({'error': str(e)}, status_code=400)
         else:
-            return jsonify({'message': 'Patient does not meet SBT eligibility criteria'}), 200
-            
-    except Exception as e:
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+            try:
+                form_data = load_form_data(body)
+            except InvalidPatientData as e:
+                return ORJSONResponse({'error': str(e)}, status_code=400)
+            result = await _batcher.submit(form_data)
 
+        _results[cache_key] = result
+        if len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
 
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5050)
+        if result:
+            return ORJSONResponse(result)
+        else:
+            return ORJSONResponse({'message': 'Patient does not meet SBT eligibility criteria'})
 
+    except Exception as e:
+        return ORJSONResponse({'error': f'Server error: {str(e)}'}, status_code=500)
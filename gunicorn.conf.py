@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for serving the SBT eligibility checker.
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:5050'
+
+# The app is ASGI, so each worker is a Uvicorn event loop rather than a
+# gevent/sync worker. Event loops don't block on I/O, so one per core is
+# enough.
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = multiprocessing.cpu_count()
+
+# Keep Numba to one thread per process
+raw_env = ['NUMBA_NUM_THREADS=1']
+
+
+def on_starting(server):
+    # Each worker also has its own process pool for large payloads. Split the
+    # cores between the workers' pools instead of giving every worker a pool
+    # of cpu_count processes. server.cfg.workers includes any -w override.
+    os.environ['SBT_POOL_WORKERS'] = str(max(1, multiprocessing.cpu_count() // server.cfg.workers))
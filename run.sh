@@ -4,6 +4,5 @@
 # Activate virtual environment
 source venv/bin/activate
 
-# Run the Flask application
-python app.py
-
+# Run the FastAPI application under Gunicorn with Uvicorn workers
+gunicorn -c gunicorn.conf.py app:app
@@ -0,0 +1,168 @@
+"""
+Micro-batching for SBT eligibility checks.
+
+Requests that arrive within a short window are collected into a single
+batch, packed into NumPy arrays and evaluated by a Numba-compiled kernel,
+so the per-request Python overhead is paid once per batch instead of once
+per patient.
+"""
+
+import asyncio
+import bisect
+from datetime import date
+from itertools import islice
+from operator import itemgetter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from numba import njit
+
+from sbt_checker import build_sbt_task, has_noradrenaline, midnight_key, timestamp_key
+
+BATCH_WINDOW = 0.01  # seconds to wait for more requests after the first one
+MAX_BATCH = 256
+
+
+def _or_nan(value: Optional[float]) -> float:
+    """Map a missing reading to NaN, which fails every threshold comparison."""
+    return np.nan if value is None else value
+
+
+# Serial on purpose: with at most MAX_BATCH patients the work is a few
+# microseconds, less than the cost of handing it to Numba's thread pool.
+@njit(cache=True)
+def _eval(fio2, peep, no_noradrenaline, offsets, hr, is_csv):
+    """
+    Evaluate the eligibility conditions for every patient in a batch.
+
+    Patient i's vitals since 12am are hr/is_csv[offsets[i]:offsets[i + 1]].
+    Values are kept in float64 so readings right at a threshold compare the
+    same way as in check_sbt_eligibility_arrays.
+    """
+    n = fio2.shape[0]
+    eligible = np.empty(n, dtype=np.bool_)
+    for i in range(n):
+        # Conditions 1 and 2 (NaN fails both comparisons, like a missing value)
+        ok = no_noradrenaline[i] and fio2[i] < 60 and peep[i] < 10
+        j = offsets[i]
+        while ok and j < offsets[i + 1]:
+            # Condition 3: no vital since 12am with csv AND daysHR < 120
+            if is_csv[j] and hr[j] < 120:
+                ok = False
+            j += 1
+        eligible[i] = ok
+    return eligible
+
+
+def evaluate_batch(patients: List[Dict[str, Any]], check_date: Optional[date] = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Check SBT eligibility for a batch of patients at once.
+
+    Applies the same conditions as check_sbt_eligibility_arrays to patients
+    passed through prepare_form_data, but the vitals of all patients are
+    flattened into arrays and checked by one compiled call.
+
+    Args:
+        patients: Patient data as posted by the form page
+        check_date: Date to check (defaults to today)
+
+    Returns:
+        A task dictionary or None for each patient, in input order
+    """
+    if check_date is None:
+        check_date = date.today()
+
+    n = len(patients)
+    check_datetime_start = midnight_key(check_date)
+    fio2 = np.full(n, np.nan)  # NaN marks a patient rejected before the kernel
+    peep = np.full(n, np.nan)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    no_noradrenaline = np.zeros(n, dtype=bool)
+    hr, is_csv = [], []
+
+    for index, form_data in enumerate(patients):
+        # Only flatten the vitals of patients that pass the cheap conditions
+        no_noradrenaline[index] = not has_noradrenaline(form_data.get('medications') or [])
+        latest_vital = form_data.get('latestVital') or {}
+        latest_timestamp = timestamp_key(latest_vital.get('timestamp'))
+        vitals = form_data.get('vitals') or []
+        # Vitals are sorted, so only the newest can be newer than latestVital
+        if (no_noradrenaline[index] and latest_timestamp is not None
+                and not (vitals and vitals[-1]['timestamp'] > latest_timestamp)):
+            fio2[index] = _or_nan(latest_vital.get('daysFiO2'))
+            peep[index] = _or_nan(latest_vital.get('daysVentPEEP'))
+
+            if fio2[index] < 60 and peep[index] < 10:
+                start = bisect.bisect_left(vitals, check_datetime_start, key=itemgetter('timestamp'))
+                for vital in islice(vitals, start, None):
+                    hr.append(_or_nan(vital.get('daysHR')))
+                    is_csv.append(vital.get('daysVentBreathSequence') == "csv")
+
+        offsets[index + 1] = len(hr)
+
+    eligible = _eval(
+        fio2, peep, no_noradrenaline, offsets,
+        np.fromiter(hr, dtype=np.float64, count=len(hr)),
+        np.fromiter(is_csv, dtype=bool, count=len(is_csv)))
+
+    return [build_sbt_task(patients[i]) if eligible[i] else None for i in range(n)]
+
+
+class EligibilityBatcher:
+    """Coalesce concurrent eligibility checks into batches."""
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start draining the queue on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._drain())
+
+    async def stop(self) -> None:
+        """Stop the background drainer."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._queue = None
+
+    async def submit(self, form_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Queue a patient for the next batch and wait for its result."""
+        if self._queue is None:
+            raise RuntimeError('EligibilityBatcher.start() has not been called; is the app lifespan running?')
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((form_data, future))
+        return await future
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = evaluate_batch([form_data for form_data, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -5,131 +5,246 @@ This module contains the logic to determine if a patient is eligible
 for a Spontaneous Breathing Trial based on clinical criteria.
 """
 
-from datetime import datetime, date, time
-from typing import Optional, Dict, Any, List
+import functools
+import math
+import re
+from datetime import datetime, date
+from operator import itemgetter
+from typing import Optional, Dict, Any, List, Tuple
 
+import numpy as np
 
-def check_sbt_eligibility(patient_json: Dict[str, Any], check_date: Optional[date] = None) -> Optional[Dict[str, Any]]:
+
+# Vital timestamps look like "2025-07-15T19:38:00". ISO-8601 strings of this
+# shape sort lexically in time order, so they are compared as strings rather
+# than parsed into datetimes. Other ISO-8601 forms are normalized to it.
+_TS_RE = re.compile(r'\d{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01])T(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d')
+
+
+class InvalidPatientData(ValueError):
+    """Posted patient data that cannot be checked, e.g. a vital with a bad timestamp."""
+
+
+def timestamp_key(timestamp_str: Any) -> Optional[str]:
     """
-    Check if a patient is eligible for SBT based on clinical criteria.
+    Normalize a vital timestamp for use as a sort/comparison key.
     
-    Conditions:
-    1. Latest vital has daysFiO2 < 60 AND daysVentPEEP < 10
-    2. No active medication order with name = 'noradrenaline'
-    3. No vital since 12am of check_date has daysVentBreathSequence = "csv" AND daysHR < 120
-    
-    Args:
-        patient_json: Patient data as a dictionary
-        check_date: Date to check (defaults to today)
+    Timestamps already in the canonical form are returned as they are. Any
+    other ISO-8601 form ("2025-07-15 19:38", "2025-07-15T19:38:00.5Z", ...)
+    is parsed and rewritten to whole seconds, with timezone-aware times
+    converted to local time like the check date.
     
     Returns:
-        Task dictionary if eligible, None otherwise
+        The canonical timestamp string, or None if it is not a valid timestamp
     """
-    if check_date is None:
-        check_date = date.today()
+    if type(timestamp_str) is str and _TS_RE.fullmatch(timestamp_str):
+        return timestamp_str
+    try:
+        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp.isoformat(timespec='seconds')
+
+
+_NORADRENALINE_RE = re.compile(r'noradrenaline', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=8)
+def midnight_key(check_date: date) -> str:
+    """Return the timestamp key for 12:00 AM of check_date (cached per date)."""
+    return check_date.isoformat() + 'T00:00:00'
+
+
+def to_float(value: Any) -> Optional[float]:
+    """
+    Convert a vital value to a float.
     
-    # Get vitals list
-    vitals = patient_json.get('vitals', [])
-    if not vitals:
+    Returns:
+        The numeric value, or None if it is missing, not numeric or not
+        finite ("NaN", "inf")
+    """
+    try:
+        number = float(value) if value is not None else None
+    except (ValueError, TypeError):
         return None
+    return number if number is not None and math.isfinite(number) else None
+
+
+def prepare_form_data(form_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize posted form data, in place, into the form the checks expect.
+    
+    - Timestamps are normalized with timestamp_key and the vitals are sorted
+      by timestamp. Monitoring systems usually send vitals in time order
+      already, which makes the sort linear.
+    - daysFiO2, daysVentPEEP and daysHR are converted with to_float, so the
+      checks only ever see a float or None.
     
-    # Find latest vital by timestamp
-    latest_vital = None
-    latest_timestamp = None
+    Returns:
+        form_data
     
-    for vital in vitals:
+    Raises:
+        InvalidPatientData: if a vital, or a non-empty latestVital, has a
+            missing timestamp or one that is not a valid ISO-8601 date and
+            time. Dropping the vital instead could make an ineligible
+            patient look eligible.
+    """
+    latest_vital = form_data.get('latestVital')
+    if latest_vital:
+        latest_vital['daysFiO2'] = to_float(latest_vital.get('daysFiO2'))
+        latest_vital['daysVentPEEP'] = to_float(latest_vital.get('daysVentPEEP'))
+        latest_vital['timestamp'] = normalize_timestamp(latest_vital.get('timestamp'), 'latestVital')
+    
+    # Inlined timestamp_key fast path; this loop touches every vital
+    match = _TS_RE.fullmatch
+    vitals = form_data.get('vitals') or []
+    for index, vital in enumerate(vitals):
         timestamp_str = vital.get('timestamp')
-        if timestamp_str:
-            try:
-                # Parse timestamp (format: "2025-07-15T19:38:00")
-                vital_timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00') if 'Z' in timestamp_str else timestamp_str)
-                if latest_timestamp is None or vital_timestamp > latest_timestamp:
-                    latest_timestamp = vital_timestamp
-                    latest_vital = vital
-            except (ValueError, AttributeError):
-                continue
-    
-    if latest_vital is None:
+        if not (type(timestamp_str) is str and match(timestamp_str)):
+            vital['timestamp'] = normalize_timestamp(timestamp_str, 'vitals.%d' % index)
+        if 'daysHR' in vital:
+            vital['daysHR'] = to_float(vital['daysHR'])
+    vitals.sort(key=itemgetter('timestamp'))
+    form_data['vitals'] = vitals
+    
+    return form_data
+
+
+def normalize_timestamp(timestamp_str: Any, where: str) -> str:
+    """
+    Return timestamp_key(timestamp_str), raising InvalidPatientData if it is
+    not a valid timestamp; where names the vital in the error message.
+    """
+    timestamp = timestamp_key(timestamp_str)
+    if timestamp is None:
+        raise InvalidPatientData('%s.timestamp: invalid timestamp %r' % (where, timestamp_str))
+    return timestamp
+
+
+def has_noradrenaline(medications: List[Optional[str]]) -> bool:
+    """Return True if any active medication name is noradrenaline."""
+    for med_name in medications:
+        if med_name and _NORADRENALINE_RE.search(med_name):
+            return True
+    return False
+
+
+def _check_medications_and_latest_vital(form_data: Dict[str, Any]) -> Optional[str]:
+    """
+    Check conditions 1 and 2, which need no scan over the vitals list.
+    
+    Returns:
+        The latestVital timestamp if both conditions hold, None otherwise
+    """
+    # Condition 2: Check no active medication order with name = 'noradrenaline'
+    if has_noradrenaline(form_data.get('medications') or []):
+        return None
+    
+    latest_vital = form_data.get('latestVital') or {}
+    latest_timestamp = timestamp_key(latest_vital.get('timestamp'))
+    if latest_timestamp is None:
         return None
     
     # Condition 1: Check latest vital - daysFiO2 < 60 AND daysVentPEEP < 10
     days_fio2 = latest_vital.get('daysFiO2')
     days_vent_peep = latest_vital.get('daysVentPEEP')
     
-    # Convert to numeric if they're strings
-    try:
-        days_fio2_num = float(days_fio2) if days_fio2 is not None else None
-    except (ValueError, TypeError):
-        days_fio2_num = None
-    
-    try:
-        days_vent_peep_num = float(days_vent_peep) if days_vent_peep is not None else None
-    except (ValueError, TypeError):
-        days_vent_peep_num = None
-    
-    if days_fio2_num is None or days_fio2_num >= 60:
+    if days_fio2 is None or days_fio2 >= 60:
         return None
     
-    if days_vent_peep_num is None or days_vent_peep_num >= 10:
+    if days_vent_peep is None or days_vent_peep >= 10:
         return None
     
-    # Condition 2: Check no active medication order with name = 'noradrenaline'
-    orders = patient_json.get('orders', {})
-    active_medications = orders.get('active', {}).get('medications', [])
+    return latest_timestamp
+
+
+def vitals_to_arrays(vitals: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert vitals to struct-of-arrays form, sorted by timestamp.
     
-    has_noradrenaline = False
-    for medication in active_medications:
-        med_name = medication.get('name', '').lower() if medication.get('name') else ''
-        if 'noradrenaline' in med_name:
-            has_noradrenaline = True
-            break
+    Timestamps are validated where the vitals are parsed, so every vital
+    passed in must already have one that passes timestamp_key.
     
-    if has_noradrenaline:
+    Returns:
+        (timestamps, daysHR, is_csv) arrays; a missing or non-numeric daysHR is NaN
+    """
+    count = len(vitals)
+    timestamps = np.array([vital['timestamp'] for vital in vitals], dtype=str)
+    days_hr = np.array([to_float(vital.get('daysHR')) for vital in vitals], dtype=np.float64)  # None becomes NaN
+    is_csv = np.fromiter((vital.get('daysVentBreathSequence') == "csv" for vital in vitals), dtype=bool, count=count)
+    
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], days_hr[order], is_csv[order]
+
+
+def check_sbt_eligibility_arrays(form_data: Dict[str, Any], timestamps: np.ndarray, days_hr: np.ndarray,
+                                 is_csv: np.ndarray, check_date: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    """
+    Check if a patient is eligible for SBT based on clinical criteria.
+    
+    Conditions:
+    1. Latest vital has daysFiO2 < 60 AND daysVentPEEP < 10
+    2. No active medication order with name = 'noradrenaline'
+    3. No vital since 12am of check_date has daysVentBreathSequence = "csv" AND daysHR < 120
+    
+    Only latestVital carries daysFiO2/daysVentPEEP; the other vitals carry
+    daysVentBreathSequence/daysHR and are given as arrays from
+    vitals_to_arrays (form_data['vitals'] is ignored). form_data must have
+    been passed through prepare_form_data.
+    
+    Args:
+        form_data: Patient data as posted by the form page (CPMRN, name,
+            lastName, hospitalName, unitName, bedNo, medications,
+            latestVital, vitals)
+        timestamps, days_hr, is_csv: The patient's vitals, from vitals_to_arrays
+        check_date: Date to check (defaults to today)
+    
+    Returns:
+        Task dictionary if eligible, None otherwise
+    """
+    if check_date is None:
+        check_date = date.today()
+    
+    latest_timestamp = _check_medications_and_latest_vital(form_data)
+    if latest_timestamp is None:
         return None
     
-    # Condition 3: Check no vital since 12am of check_date has daysVentBreathSequence = "csv" AND daysHR < 120
-    check_datetime_start = datetime.combine(check_date, time.min)  # 12:00 AM of check_date
+    # A vital newer than latestVital has no FiO2/PEEP reading, so condition 1 fails
+    if len(timestamps) and timestamps[-1] > latest_timestamp:
+        return None
     
-    for vital in vitals:
-        timestamp_str = vital.get('timestamp')
-        if not timestamp_str:
-            continue
-        
-        try:
-            vital_timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00') if 'Z' in timestamp_str else timestamp_str)
-            
-            # Only check vitals from 12am of check_date onwards
-            if vital_timestamp < check_datetime_start:
-                continue
-            
-            days_vent_breath_sequence = vital.get('daysVentBreathSequence')
-            days_hr = vital.get('daysHR')
-            
-            # Check if daysVentBreathSequence = "csv"
-            if days_vent_breath_sequence == "csv":
-                # Check if daysHR < 120
-                try:
-                    days_hr_num = float(days_hr) if days_hr is not None else None
-                    if days_hr_num is not None and days_hr_num < 120:
-                        # Found a vital that violates condition 3
-                        return None
-                except (ValueError, TypeError):
-                    pass
-        except (ValueError, AttributeError):
-            continue
-    
-    # All conditions met - generate task JSON
-    patient_name = patient_json.get('name', '')
-    patient_lastname = patient_json.get('lastName', '')
+    # Condition 3: no vital since 12am of check_date has csv AND daysHR < 120
+    # (NaN never compares below 120)
+    start = np.searchsorted(timestamps, midnight_key(check_date))
+    if np.any(is_csv[start:] & (days_hr[start:] < 120)):
+        return None
+    
+    return build_sbt_task(form_data)
+
+
+def build_sbt_task(form_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the task JSON for a patient who meets all SBT criteria.
+    
+    Args:
+        form_data: Patient data as posted by the form page
+    
+    Returns:
+        Task dictionary
+    """
+    patient_name = form_data.get('name', '')
+    patient_lastname = form_data.get('lastName', '')
     full_name = f"{patient_name} {patient_lastname}".strip() if patient_name or patient_lastname else ''
     
     task = {
         'createdBy': 'SBT agent',
-        'CPMRN': patient_json.get('CPMRN', ''),
+        'CPMRN': form_data.get('CPMRN', ''),
         'patientName': full_name,
-        'hospital': patient_json.get('hospitalName', ''),
-        'unit': patient_json.get('unitName', ''),
-        'BedNumber': patient_json.get('bedNo', ''),
+        'hospital': form_data.get('hospitalName', ''),
+        'unit': form_data.get('unitName', ''),
+        'BedNumber': form_data.get('bedNo', ''),
         'createdAt': datetime.now().isoformat(),
         'Urgency': 'Low',
         'Message': 'Please order a SBT for this patient as patient is not on noradrenaline, and fio2 is less than 0.6 with a peep less than 10'
@@ -0,0 +1,88 @@
+"""
+Parsing and validation of /check request bodies.
+
+This module is kept free of web-framework imports, because it is also the
+entry point of the worker processes that check large bodies: each of them
+imports only this module and sbt_checker, not the whole application.
+"""
+
+import bisect
+from datetime import date
+from operator import itemgetter
+from typing import Any, Dict, List, Optional
+
+import orjson
+from pydantic import BaseModel, ConfigDict, ValidationError, model_validator
+from pydantic_core import PydanticCustomError
+
+from sbt_checker import (InvalidPatientData, check_sbt_eligibility_arrays, midnight_key, prepare_form_data,
+                         vitals_to_arrays)
+
+
+class PatientIn(BaseModel):
+    """Patient data as posted by the form page."""
+
+    # Identity fields are passed through to the task; monitoring systems often
+    # send CPMRN and bedNo as numbers
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    CPMRN: Optional[str] = ''
+    name: Optional[str] = ''
+    lastName: Optional[str] = ''
+    hospitalName: Optional[str] = ''
+    unitName: Optional[str] = ''
+    bedNo: Optional[str] = ''
+    medications: List[Optional[str]] = []
+    latestVital: Optional[Dict[str, Any]] = None
+    vitals: List[Dict[str, Any]] = []
+
+    @model_validator(mode='before')
+    @classmethod
+    def _not_empty(cls, data: Any) -> Any:
+        if not data:
+            raise PydanticCustomError('no_data', 'No data provided')
+        return data
+
+
+def validation_message(error: ValidationError) -> str:
+    """Summarize a validation error as "field: reason; ..." for the 400 response."""
+    return '; '.join(
+        '%s: %s' % ('.'.join(map(str, err['loc'])), err['msg']) if err['loc'] else err['msg']
+        for err in error.errors())
+
+
+def load_form_data(body: bytes) -> Dict[str, Any]:
+    """
+    Parse and validate a /check body and pass it through prepare_form_data.
+    
+    orjson rejects NaN and Infinity literals, which are not JSON.
+    
+    Raises:
+        InvalidPatientData: if the body is not valid JSON or patient data
+    """
+    try:
+        payload = PatientIn.model_validate(orjson.loads(body))
+    except orjson.JSONDecodeError as e:
+        raise InvalidPatientData('Invalid JSON: %s' % e) from None
+    except ValidationError as e:
+        raise InvalidPatientData(validation_message(e)) from None
+    return prepare_form_data(payload.model_dump())
+
+
+def check_large_payload(body: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Parse a large /check body and check eligibility; runs in a pool worker.
+    
+    Only vitals since 12am of the check date, plus the newest one before it
+    to compare against latestVital, are converted to arrays.
+    
+    Raises:
+        InvalidPatientData: if the body is not valid JSON or patient data
+    """
+    check_date = date.today()
+    form_data = load_form_data(body)
+    
+    vitals = form_data['vitals']
+    start = bisect.bisect_left(vitals, midnight_key(check_date), key=itemgetter('timestamp'))
+    timestamps, days_hr, is_csv = vitals_to_arrays(vitals[max(start - 1, 0):])
+    return check_sbt_eligibility_arrays(form_data, timestamps, days_hr, is_csv, check_date)
@@ -0,0 +1,195 @@
+"""
+End-to-end tests of /check.
+
+Every case runs twice: once through the small-body path (batched kernel in
+sbt_batcher) and once through the large-body path (pool worker in
+sbt_ingest with check_sbt_eligibility_arrays), so the two implementations
+of the rule are held to the same answers. Valid payloads are also compared
+against baseline_eligible, the rule as the original Flask checker applied it.
+"""
+
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as sbt_app
+
+TODAY = date.today().isoformat()
+YESTERDAY = (date.today() - timedelta(days=1)).isoformat()
+
+
+def baseline_eligible(form, check_date):
+    """
+    The original checker: the newest of latestVital and vitals must have
+    FiO2 < 60 and PEEP < 10, no medication may mention noradrenaline, and no
+    vital since 12am may be csv with HR < 120. Only defined for payloads
+    with valid, timezone-naive timestamps.
+    """
+    def parse(timestamp):
+        return datetime.fromisoformat(timestamp)
+
+    def number(value):
+        try:
+            return float(value) if value is not None else None
+        except (ValueError, TypeError):
+            return None
+
+    records = ([form['latestVital']] if form.get('latestVital') else []) + form.get('vitals', [])
+    if not records:
+        return False
+    newest = max(records, key=lambda vital: parse(vital['timestamp']))  # first wins ties, as before
+    fio2, peep = number(newest.get('daysFiO2')), number(newest.get('daysVentPEEP'))
+    if fio2 is None or fio2 >= 60 or peep is None or peep >= 10:
+        return False
+    if any(med and 'noradrenaline' in med.strip().lower() for med in form.get('medications', [])):
+        return False
+    midnight = datetime.combine(check_date, datetime.min.time())
+    for vital in form.get('vitals', []):
+        if parse(vital['timestamp']) >= midnight and vital.get('daysVentBreathSequence') == 'csv':
+            hr = number(vital.get('daysHR'))
+            if hr is not None and hr < 120:
+                return False
+    return True
+
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(sbt_app.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(params=['small', 'large'])
+def check(request, client, monkeypatch):
+    """POST a payload through one of the two paths and return the outcome."""
+    monkeypatch.setattr(sbt_app, '_results', type(sbt_app._results)())
+    if request.param == 'large':
+        monkeypatch.setattr(sbt_app, 'POOL_BODY_THRESHOLD', -1)
+
+    def post(form=None, content=None):
+        response = client.post('/check', json=form) if content is None else client.post('/check', content=content)
+        if response.status_code == 400:
+            return 400
+        assert response.status_code == 200, response.text
+        return 'eligible' if 'createdBy' in response.json() else 'ineligible'
+    return post
+
+
+def patient(fio2=40, peep=5, latest_at=TODAY + 'T23:59:59', medications=(), vitals=()):
+    return {
+        'CPMRN': 'CP1', 'name': 'Ann', 'lastName': 'Lee', 'hospitalName': 'H', 'unitName': 'ICU', 'bedNo': '4',
+        'medications': list(medications),
+        'latestVital': {'timestamp': latest_at, 'daysFiO2': fio2, 'daysVentPEEP': peep},
+        'vitals': list(vitals),
+    }
+
+
+def csv_vital(timestamp, hr):
+    return {'timestamp': timestamp, 'daysVentBreathSequence': 'csv', 'daysHR': hr}
+
+
+CASES = [
+    # Condition 1 thresholds
+    ('fio2-below', patient(fio2=59.9), 'eligible'),
+    ('fio2-at', patient(fio2=60), 'ineligible'),
+    ('fio2-string', patient(fio2='45'), 'eligible'),
+    ('peep-below', patient(peep=9.99), 'eligible'),
+    ('peep-at', patient(peep=10), 'ineligible'),
+    ('fio2-missing', patient(fio2=None), 'ineligible'),
+    ('no-latest-vital', {**patient(), 'latestVital': None}, 'ineligible'),
+    # Condition 2
+    ('noradrenaline', patient(medications=['heparin', 'Noradrenaline 4mg']), 'ineligible'),
+    ('other-medication', patient(medications=['heparin', '', None]), 'eligible'),
+    # Condition 3 thresholds and the midnight boundary
+    ('csv-hr-below', patient(vitals=[csv_vital(TODAY + 'T08:00:00', 119.9)]), 'ineligible'),
+    ('csv-hr-at', patient(vitals=[csv_vital(TODAY + 'T08:00:00', 120)]), 'eligible'),
+    ('cmv-hr-low', patient(vitals=[{'timestamp': TODAY + 'T08:00:00', 'daysVentBreathSequence': 'cmv',
+                                    'daysHR': 80}]), 'eligible'),
+    ('csv-hr-missing', patient(vitals=[{'timestamp': TODAY + 'T08:00:00', 'daysVentBreathSequence': 'csv'}]),
+     'eligible'),
+    ('csv-at-midnight', patient(vitals=[csv_vital(TODAY + 'T00:00:00', 100)]), 'ineligible'),
+    ('csv-before-midnight', patient(vitals=[csv_vital(YESTERDAY + 'T23:59:59', 100)]), 'eligible'),
+    # A vital newer than latestVital has no FiO2/PEEP, so condition 1 fails
+    ('vital-newer-than-latest', patient(latest_at=TODAY + 'T06:00:00',
+                                        vitals=[csv_vital(TODAY + 'T07:00:00', 130)]), 'ineligible'),
+    ('vital-same-time-as-latest', patient(latest_at=TODAY + 'T07:00:00',
+                                          vitals=[csv_vital(TODAY + 'T07:00:00', 130)]), 'eligible'),
+    # Non-canonical ISO-8601 timestamps are normalized, never dropped
+    ('latest-without-seconds', patient(latest_at=TODAY + 'T17:30'), 'eligible'),
+    ('latest-space-separator', patient(latest_at=TODAY + ' 13:00:00'), 'eligible'),
+    ('vital-without-seconds', patient(vitals=[csv_vital(TODAY + 'T05:00', 100)]), 'ineligible'),
+    ('vital-space-separator', patient(vitals=[csv_vital(TODAY + ' 05:00:00', 100)]), 'ineligible'),
+    ('vital-fractional-seconds', patient(vitals=[csv_vital(TODAY + 'T05:00:00.250', 100)]), 'ineligible'),
+    # Invalid or missing timestamps are rejected
+    ('vital-invalid-timestamp', patient(vitals=[csv_vital('yesterday', 100)]), 400),
+    ('vital-month-13', patient(vitals=[csv_vital('2025-13-01T00:00:00', 100)]), 400),
+    ('vital-missing-timestamp', patient(vitals=[{'daysVentBreathSequence': 'csv', 'daysHR': 100}]), 400),
+    ('latest-invalid-timestamp', patient(latest_at='not a time'), 400),
+    ('latest-null-timestamp', patient(latest_at=None), 400),
+    # Non-finite readings count as missing
+    ('fio2-nan-string', patient(fio2='NaN'), 'ineligible'),
+    ('fio2-minus-inf-string', patient(fio2='-inf'), 'ineligible'),
+    ('csv-hr-nan-string', patient(vitals=[csv_vital(TODAY + 'T08:00:00', 'NaN')]), 'eligible'),
+    # Malformed payloads
+    ('empty', {}, 400),
+    ('vitals-not-a-list', {**patient(), 'vitals': {'item': {'timestamp': 'x'}}}, 400),
+    ('vital-not-an-object', {**patient(), 'vitals': [7]}, 400),
+]
+
+
+@pytest.mark.parametrize('form, expected', [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_check(check, form, expected):
+    assert check(form) == expected
+
+
+@pytest.mark.parametrize('literal', ['NaN', 'Infinity', '-Infinity'])
+def test_non_finite_json_literal_is_rejected(check, literal):
+    body = '{"latestVital": {"timestamp": "%sT23:59:59", "daysFiO2": %s, "daysVentPEEP": 5}}' % (TODAY, literal)
+    assert check(content=body.encode()) == 400
+
+
+def test_invalid_body_is_rejected_even_after_noradrenaline(check):
+    body = '{"medications": ["noradrenaline"], "vitals": [{"timestamp": "%sT01:00:00"' % TODAY
+    assert check(content=body.encode()) == 400
+
+
+def test_numeric_identity_fields(client):
+    form = {**patient(), 'CPMRN': 123, 'bedNo': 7}
+    task = client.post('/check', json=form).json()
+    assert (task['CPMRN'], task['BedNumber']) == ('123', '7')
+
+
+def random_patient(rnd):
+    def timestamp():
+        day = rnd.choice([TODAY, YESTERDAY])
+        hour, minute, second = rnd.randrange(24), rnd.randrange(60), rnd.randrange(60)
+        return rnd.choice([
+            '%sT%02d:%02d:%02d' % (day, hour, minute, second),
+            '%s %02d:%02d:%02d' % (day, hour, minute, second),
+            '%sT%02d:%02d' % (day, hour, minute),
+        ])
+
+    def reading(low, high):
+        return rnd.choice([None, 'x', str(rnd.randint(low, high)), rnd.randint(low, high), rnd.uniform(low, high)])
+
+    vitals = []
+    for _ in range(rnd.choice([0, 1, 5, 80])):
+        vital = {'timestamp': timestamp()}
+        if rnd.random() < 0.8:
+            vital['daysVentBreathSequence'] = rnd.choice(['csv', 'csv', 'cmv', None])
+        if rnd.random() < 0.8:
+            vital['daysHR'] = reading(90, 150)
+        vitals.append(vital)
+    latest_at = rnd.choice([timestamp(), TODAY + 'T23:59:59'])
+    medications = [rnd.choice(['heparin', 'Noradrenaline', 'paracetamol']) for _ in range(rnd.randrange(3))]
+    return patient(reading(20, 70), reading(2, 12), latest_at, medications, vitals)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_baseline(check, seed):
+    rnd = random.Random(seed)
+    for _ in range(100):
+        form = random_patient(rnd)
+        expected = 'eligible' if baseline_eligible(form, date.today()) else 'ineligible'
+        assert check(form) == expected, form